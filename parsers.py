@@ -0,0 +1,221 @@
+# parsers.py
+"""Чистые функции разбора HTML/JSON-LD, вынесенные из server.py.
+
+Модуль не знает про asyncio и браузер — на входе байты страницы, на
+выходе цена. Благодаря этому (и полным аннотациям типов) его можно
+AOT-компилировать mypyc-ом или Cython-ом, убрав интерпретаторный
+диспатч с самого горячего пути; без компиляции работает как обычный
+Python.
+"""
+import re
+from typing import Iterator
+
+import orjson
+
+try:
+    # C-парсер HTML (~на порядок быстрее регэкспов по всей странице)
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# таблица для очистки цены за один C-проход вместо цепочки .replace()
+_PRICE_STRIP = str.maketrans("", "", " \xa0\t\n\r\"'₴грн")
+
+_NUM_RE = re.compile(r"\d+(?:\.\d+)?")
+
+# регэкспы компилируем один раз при импорте — парсер зовётся на каждый URL.
+# Паттерны байтовые: HTTP-путь не декодирует страницу в str (это копия
+# всей страницы плюс UTF-8 -> UTF-16), а сканирует resp.content как есть.
+# Одна альтернация вместо серии отдельных паттернов: HTML сканируется
+# один раз, а не по разу на каждый вариант разметки
+_PRICE_COMBINED_RE = re.compile(
+    # \xc2\xa0 — неразрывный пробел в UTF-8: в байтовом классе \s его
+    # уже не покрывает, а Rozetka разделяет им тысячи в цене
+    rb'class="[^"]*product-price__big[^"]*"[^>]*>(?P<big>[\d\s\xc2\xa0]+)'
+    rb'|itemprop="price"[^>]*content="(?P<itemprop>[\d.]+)"'
+    # пробелы/NBSP внутри числа: '"price": "1 299"' должен давать 1299,
+    # а не обрезаться до первой группы цифр; мусор отсеет clean_price
+    rb'|"price"\s*:\s*"?(?P<json>\d[\d.\s\xc2\xa0]*)'
+    rb'|data-price="(?P<data>\d+)"',
+    re.I | re.DOTALL,
+)
+
+# якоря для bytes.find: находим окно с ценой C-поиском подстроки и гоняем
+# регэксп только по нему, а не по сотням КБ всей страницы
+_PRICE_ANCHORS = (b"product-price__big", b'itemprop="price"', b'"price"', b"data-price=")
+
+# маркеры «товара нет»: одна альтернация с re.I вместо html.lower()
+# (не копируем 200КБ страницы) и вместо цикла `in` по списку — один
+# C-проход по тексту на все варианты сразу. Сюда же сложены маркеры
+# «страница не найдена» — отдельный проход под них не нужен
+UNAVAIL_RE = re.compile(
+    r"немає в наявності"
+    r"|товар закінчився"
+    r"|нет в наличии"
+    r"|out of stock"
+    r'|"OutOfStock"'
+    r"|сторінку не знайдено"
+    r"|страница не найдена"
+    r"|page not found",
+    re.I,
+)
+
+
+def clean_price(raw: object) -> str | None:
+    """Единая точка очистки цены: translate + проверка, что осталось число.
+
+    Раньше каждый экстрактор чистил сырую строку сам и мог вернуть
+    мусор вроде "від1299" из хитрой разметки.
+    """
+    if raw is None:
+        return None
+    cleaned = str(raw).translate(_PRICE_STRIP)
+    if cleaned and _NUM_RE.fullmatch(cleaned):
+        return cleaned
+    return None
+
+
+def _iter_ldjson(html: bytes) -> Iterator[bytes]:
+    """Лениво нарезает содержимое JSON-LD блоков C-поиском подстрок.
+
+    Регэксп с DOTALL на такой задаче сканирует всю страницу и собирает
+    все блоки разом; три bytes.find на блок дешевле и без копий лишнего.
+    """
+    pos = 0
+    while True:
+        idx = html.find(b"application/ld+json", pos)
+        if idx < 0:
+            return
+        start = html.find(b">", idx)
+        if start < 0:
+            return
+        end = html.find(b"</script>", start)
+        if end < 0:
+            return
+        yield html[start + 1 : end]
+        pos = end + len(b"</script>")
+
+
+def extract_price_from_ld(item: object) -> str | None:
+    """Достать цену из JSON-LD объекта Product."""
+    if not isinstance(item, dict):
+        return None
+    # schema.org позволяет заворачивать объекты в @graph — Product
+    # тогда лежит на уровень глубже
+    graph = item.get("@graph")
+    if isinstance(graph, list):
+        for sub in graph:
+            price = extract_price_from_ld(sub)
+            if price:
+                return price
+    if item.get("@type") != "Product":
+        return None
+    offers = item.get("offers")
+    # schema.org разрешает и одиночный Offer, и их список; строка или
+    # другой мусор на этом месте цены не содержит
+    if isinstance(offers, dict):
+        offers = [offers]
+    if not isinstance(offers, list):
+        return None
+    for offer in offers:
+        if not isinstance(offer, dict):
+            continue
+        price = clean_price(
+            offer.get("price") or offer.get("lowPrice") or offer.get("highPrice")
+        )
+        if price:
+            return price
+    return None
+
+
+def parse_price_from_html(html: bytes) -> str | None:
+    """Достать цену прямо из сырых байтов HTML (без браузера и декода)."""
+    if LexborHTMLParser is not None:
+        return _parse_price_lexbor(html)
+    return _parse_price_regex(html)
+
+
+def _parse_price_lexbor(html: bytes) -> str | None:
+    """Один проход C-парсером: JSON-LD, затем селекторы цены."""
+    tree = LexborHTMLParser(html)
+
+    # дешёвый `in` по байтам: на страницах без JSON-LD css-обход не нужен
+    if b"ld+json" in html:
+        for node in tree.css('script[type="application/ld+json"]'):
+            text = node.text()
+            if '"Product"' not in text:
+                continue
+            try:
+                data = orjson.loads(text)
+            except Exception:
+                continue
+            items = data if isinstance(data, list) else [data]
+            for item in items:
+                price = extract_price_from_ld(item)
+                if price:
+                    return price
+
+    node = tree.css_first(
+        '.product-price__big, [itemprop="price"], .product-prices__big'
+    )
+    if node:
+        price = clean_price(node.text())
+        if price:
+            return price
+
+    return None
+
+
+def _parse_price_regex(html: bytes) -> str | None:
+    """Fallback на регэкспы, когда selectolax не установлен."""
+    # 1) JSON-LD блоки
+    for block in _iter_ldjson(html):
+        if b'"Product"' not in block:
+            continue
+        # быстрый путь: '"price": 1299' достаётся поиском литерала и
+        # регэкспом по 64-байтному окну — без JSON-парса всего блока
+        i = block.find(b'"price"')
+        if i >= 0:
+            m = _PRICE_COMBINED_RE.search(block, i, i + 64)
+            if m and m.lastgroup == "json":
+                price = clean_price(m.group("json").decode("ascii", "ignore"))
+                if price:
+                    return price
+        # литерал не разобрался (экранирование, вложенность) —
+        # честный парс блока
+        try:
+            data = orjson.loads(block)
+        except Exception:
+            continue
+        if isinstance(data, list):
+            for item in data:
+                price = extract_price_from_ld(item)
+                if price:
+                    return price
+        else:
+            price = extract_price_from_ld(data)
+            if price:
+                return price
+
+    # 2) Fallback — цена прямо в разметке; сначала дешёвый поиск якоря,
+    # регэксп работает только по маленькому окну вокруг него
+    for anchor in _PRICE_ANCHORS:
+        idx = html.find(anchor)
+        if idx < 0:
+            continue
+        window = html[max(0, idx - 256) : idx + 2048]
+        m = _PRICE_COMBINED_RE.search(window)
+        if m:
+            # декодируем только совпавший кусочек, а не страницу
+            price = clean_price(m.group(m.lastgroup).decode("utf-8", "ignore"))
+            if price:
+                return price
+
+    # якорей нет (например, другой регистр) — последний шанс по всей странице
+    m = _PRICE_COMBINED_RE.search(html)
+    if m:
+        price = clean_price(m.group(m.lastgroup).decode("utf-8", "ignore"))
+        if price:
+            return price
+
+    return None
@@ -1,166 +1,650 @@
 # server.py
 from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
 import uvicorn
 import asyncio
+import httpx
+from cachetools import TTLCache
 from playwright.async_api import async_playwright
 from playwright_stealth import Stealth
-import json
-import time
+import functools
+import logging
+import logging.handlers
+import orjson
+import os
+import queue
+import re
 import random
+import time
+from collections import deque
 from urllib.parse import urlparse
 
-app = FastAPI()
+# чистый разбор HTML живёт в отдельном модуле без asyncio и браузера —
+# при желании его можно AOT-скомпилировать (см. docstring parsers.py)
+from parsers import (
+    UNAVAIL_RE,
+    clean_price,
+    extract_price_from_ld,
+    parse_price_from_html,
+)
+
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# print() под нагрузкой блокирует event loop на записи в stdout;
+# логи уводим через QueueHandler в отдельный поток QueueListener
+logger = logging.getLogger("rozetka")
 
-cache: dict[str, dict] = {}
 CACHE_TTL = 3600  # 1 час
-MAX_CONCURRENCY = 5  # сколько страниц одновременно
+CACHE_MAX_SIZE = 10_000  # чтобы кэш не рос бесконечно
+
+# TTL + LRU: старые и давно не спрошенные записи вытесняются сами
+cache: TTLCache = TTLCache(maxsize=CACHE_MAX_SIZE, ttl=CACHE_TTL)
+
+# валидаторы последнего удачного HTTP-ответа: url -> (etag, last_modified, цена).
+# Живут дольше кэша цен: протухшую цену можно обновить условным GET-ом
+_validators: TTLCache = TTLCache(maxsize=CACHE_MAX_SIZE, ttl=24 * 3600)
+POOL_SIZE = 5  # сколько тёплых вкладок (и значит параллельных скрапов)
+# контекст — это отдельный «профиль» Chromium с собственной парой сотен
+# мегабайт; параллелизм дают вкладки, так что контекстов хватает двух —
+# для разнообразия отпечатков, а не для конкарренси
+CONTEXT_COUNT = 2
+
+# по User-Agent на контекст: вкладки одного контекста выглядят одним
+# «пользователем», контексты между собой — разными
+_UA_POOL = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/91.0.4472.124 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+    "AppleWebKit/537.36 (KHTML, like Gecko) "
+    "Chrome/120.0.0.0 Safari/537.36",
+)
+
+UA_HEADERS = {
+    "User-Agent": _UA_POOL[0],
+    # zstd впереди: жмёт сравнимо с brotli, а распаковывается заметно быстрее
+    "Accept-Encoding": "zstd, br, gzip, deflate",
+    # как у реального украинского браузера — и меньше шанс редиректа
+    # на региональную версию страницы
+    "Accept-Language": "uk-UA,uk;q=0.9,en;q=0.8",
+}
+
+# URL-ы, которые прямо сейчас скрапятся: второй запрос на тот же URL
+# не открывает новую вкладку, а ждёт результат первого
+_inflight: dict[str, asyncio.Future] = {}
+
+MAX_REQUESTS_PER_MINUTE = 60
+MIN_HOST_GAP = 0.5  # минимум секунд между двумя заходами на один хост
+
+JOB_QUEUE_SIZE = 100  # шквал /update не должен раздувать пул задач
+JOB_WORKERS = 2  # сколько батчей обрабатываем одновременно
+MAX_BATCH = 5_000  # больше за раз всё равно не прожуём — лучше честный 413
+
+
+async def _post_webhook(webhook: str, payload: dict):
+    """Шлём результат вебхуком через общий клиент (keep-alive, не блокирует loop)."""
+    try:
+        await app.state.http_client.post(webhook, json=payload, timeout=30)
+    except Exception as e:
+        logger.warning("Webhook post failed for %s: %s", webhook, e)
+
+
+async def _job_worker():
+    while True:
+        urls, fut, webhook = await app.state.jobs.get()
+        try:
+            prices = await scrape_batch(urls)
+        except Exception as e:
+            logger.error("Batch job failed: %s", e)
+            if fut and not fut.done():
+                fut.set_exception(e)
+            if webhook:
+                # клиенту уже ответили "accepted" — молча терять джобу
+                # нельзя, иначе он будет ждать вебхук вечно
+                await _post_webhook(webhook, {"error": str(e)})
+            continue
+        if fut and not fut.done():
+            fut.set_result(prices)
+        if webhook:
+            await _post_webhook(webhook, {"data": prices})
+
+
+# скользящее окно: deque даёт O(1) на запись и чистку старых отметок
+_request_times: deque[float] = deque()
+
+# последний заход по хостам: общий лимит может быть не выбран, а один
+# хост всё равно не стоит долбить очередью подряд идущих запросов
+_last_hit: TTLCache = TTLCache(maxsize=1_000, ttl=300)
+
+
+async def smart_delay(url: str | None = None):
+    """Притормаживает, если за последнюю минуту запросов было слишком много.
+
+    С url дополнительно выдерживает MIN_HOST_GAP до следующего захода
+    на тот же хост.
+    """
+    # слот резервируем до сна: иначе параллельные воркеры прочитают одно
+    # и то же время, проспят одинаковую паузу и ударят по хосту разом
+    if url:
+        host = urlparse(url).netloc
+        now = time.monotonic()
+        slot = max(now, _last_hit.get(host, 0) + MIN_HOST_GAP)
+        _last_hit[host] = slot
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    now = time.monotonic()
+    while _request_times and now - _request_times[0] > 60:
+        _request_times.popleft()
+    wake = now
+    if len(_request_times) >= MAX_REQUESTS_PER_MINUTE:
+        # наш слот освободится, когда из окна выйдет отметка на
+        # MAX_REQUESTS_PER_MINUTE позиций раньше нашей — она может быть
+        # и зарезервированной, поэтому каждый ждун получает своё время
+        wake = _request_times[len(_request_times) - MAX_REQUESTS_PER_MINUTE] + 60
+    _request_times.append(wake)
+    if wake > now:
+        await asyncio.sleep(wake - now)
+
+
+# ресурсы, которые парсеру цены не нужны — не качаем их вовсе
+BLOCKED_RESOURCE_TYPES = {"image", "stylesheet", "font", "media"}
+BLOCKED_URL_PARTS = (
+    "doubleclick",
+    "googletagmanager",
+    "google-analytics",
+    "hotjar",
+    "facebook",
+    "criteo",
+)
+
+
+async def block_heavy_resources(route):
+    """Режет картинки/шрифты/стили и трекеры; XHR не трогаем — там бывает цена."""
+    request = route.request
+    if request.resource_type in BLOCKED_RESOURCE_TYPES or any(
+        part in request.url for part in BLOCKED_URL_PARTS
+    ):
+        await route.abort()
+    else:
+        await route.continue_()
 
 
+# один evaluate забирает всё нужное из DOM разом: тексты JSON-LD блоков
+# и текст ценового элемента. Один CDP round-trip на несколько десятков
+# байт вместо локаторов (count + inner_text = ещё два round-trip-а)
+_PAGE_PROBE_JS = (
+    "() => ({"
+    "  lds: Array.from(document.querySelectorAll("
+    "    'script[type=\"application/ld+json\"]')).map(s => s.textContent),"
+    "  priceText: document.querySelector("
+    "    '.product-price__big, [itemprop=\"price\"], .product-prices__big'"
+    "  )?.textContent ?? null"
+    "})"
+)
+
+
+# Все рантайм-синглтоны (Playwright, браузер, слоты пула, HTTP-клиент,
+# очередь задач) живут на app.state: один источник правды вместо россыпи
+# global-переменных, и ничего не нужно ребиндить из обработчиков.
+# Браузер поднимаем один раз на весь процесс: холодный старт Chromium
+# стоит 1-2 секунды, платить их на каждый /update слишком дорого.
+# Слот пула — это (context, page, lock): вкладка живёт столько же,
+# сколько контекст, а лок гарантирует один goto на вкладку за раз
+
+
+# один Stealth на процесс: JS-бандл собирается при создании объекта,
+# пересобирать его на каждый контекст незачем
+_stealth = Stealth()
+
+
+async def create_browser_context(user_agent: str | None = None):
+    """Создаёт контекст со stealth-скриптом, блокировкой ресурсов и UA."""
+    context = await app.state.browser.new_context()
+    # init-скрипт вешается на контекст один раз и наследуется всеми
+    # вкладками; он уже прячет navigator.webdriver и прочие следы
+    await _stealth.apply_stealth_async(context)
+    await context.route("**/*", block_heavy_resources)
+    headers = UA_HEADERS
+    if user_agent:
+        headers = {**UA_HEADERS, "User-Agent": user_agent}
+    await context.set_extra_http_headers(headers)
+    return context
+
+
+@app.on_event("startup")
+async def startup_event():
+    # запись в stdout делает поток листенера, корутины только кладут
+    # записи в очередь — это дёшево и не держит loop
+    log_queue: queue.Queue = queue.Queue(-1)
+    handler = logging.StreamHandler()
+    handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    app.state.log_listener = logging.handlers.QueueListener(log_queue, handler)
+    app.state.log_listener.start()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(os.environ.get("ROZETKA_LOG_LEVEL", "INFO").upper())
+
+    # общий HTTP-клиент для быстрого пути без браузера
+    app.state.http_client = httpx.AsyncClient(
+        http2=True,
+        headers=UA_HEADERS,
+        timeout=10,
+        follow_redirects=True,
+        # почти все запросы идут на один хост: держим keep-alive
+        # соединений с запасом, чтобы пул не пересоздавал TLS-сессии
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=64),
+    )
+
+    app.state.pw = await async_playwright().start()
+    profile_dir = os.environ.get("ROZETKA_PROFILE_DIR")
+    if profile_dir:
+        # персистентный профиль: HTTP-кэш, куки и скомпилированный JS
+        # Chromium-а переживают рестарт сервиса — повторные заходы на
+        # Rozetka качают заметно меньше байт. Профиль один, поэтому
+        # контекст тоже один на все вкладки
+        app.state.browser = None
+        context = await app.state.pw.chromium.launch_persistent_context(
+            profile_dir, headless=True
+        )
+        await _stealth.apply_stealth_async(context)
+        await context.route("**/*", block_heavy_resources)
+        await context.set_extra_http_headers(UA_HEADERS)
+        app.state.contexts = [context]
+    else:
+        app.state.browser = await app.state.pw.chromium.launch(headless=True)
+        app.state.contexts = [
+            await create_browser_context(_UA_POOL[i % len(_UA_POOL)])
+            for i in range(CONTEXT_COUNT)
+        ]
+    app.state.slots = []
+    for i in range(POOL_SIZE):
+        # вкладки размазываем по контекстам по кругу
+        context = app.state.contexts[i % len(app.state.contexts)]
+        page = await context.new_page()
+        app.state.slots.append((context, page, asyncio.Lock()))
+
+    app.state.jobs = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)
+    app.state.job_tasks = [
+        asyncio.create_task(_job_worker()) for _ in range(JOB_WORKERS)
+    ]
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    state = app.state
+    for task in state.job_tasks:
+        task.cancel()
+    state.job_tasks.clear()
+    await state.http_client.aclose()
+    for context in state.contexts:
+        await context.close()
+    state.contexts.clear()
+    state.slots.clear()
+    if state.browser:  # в персистентном режиме браузер живёт в контексте
+        await state.browser.close()
+    await state.pw.stop()
+    state.log_listener.stop()
+
+
+# схема + непустой netloc — то же, что проверял urlparse, но одним
+# match-ом без разбора всего URL на компоненты
+_URL_RE = re.compile(r"https?://[^/\s?#]+", re.I)
+
+
+@functools.lru_cache(maxsize=10_000)
 def is_valid_http_url(s: str) -> bool:
-    """Проверка, что строка выглядит как нормальный http/https URL."""
-    if not isinstance(s, str):
-        return False
+    """Проверка, что строка выглядит как нормальный http/https URL.
+
+    Клиенты шлют одни и те же URL-ы раз за разом, так что результат
+    проверки выгодно запомнить.
+    """
+    return bool(_URL_RE.match(s.strip()))
+
+
+@functools.lru_cache(maxsize=10_000)
+def _normalize_url(s: str) -> str | None:
+    """Валидация и нормализация URL в одной точке.
+
+    Обрезаем пробелы и #fragment: фрагмент до сервера всё равно не
+    доходит, а в ключах кэша плодит дубли одного и того же товара.
+    """
     s = s.strip()
-    if not s:
-        return False
-    try:
-        u = urlparse(s)
-        return u.scheme in ("http", "https") and bool(u.netloc)
-    except Exception:
-        return False
+    if not _URL_RE.match(s):
+        return None
+    i = s.find("#")
+    if i >= 0:
+        s = s[:i]
+    return s
 
 
-async def scrape_price_single(page, url: str) -> str | None:
-    """Скрапит цену для одного товара в уже созданной вкладке."""
+async def scrape_price_single(page, url: str) -> tuple[str | None, int | None]:
+    """Скрапит цену для одного товара в уже созданной вкладке.
+
+    Возвращает (цена, HTTP-статус навигации), чтобы вызывающий мог
+    отличить временный сбой от «страницы без цены».
+    """
     # кэш
-    if url in cache and time.time() - cache[url]["time"] < CACHE_TTL:
-        return cache[url]["price"]
+    cached = cache.get(url)
+    if cached:
+        return cached, 200
 
+    await smart_delay(url)
     try:
-        await page.goto(url, timeout=60000, wait_until="domcontentloaded")
-        await asyncio.sleep(random.uniform(2, 5))
+        # commit: goto возвращается по заголовкам ответа, не дожидаясь
+        # постройки DOM — быстрое «HTML уже едет», а дальше пробу и
+        # wait_for_selector ниже сами дождутся нужных узлов
+        response = await page.goto(url, timeout=8000, wait_until="commit")
+        status = response.status if response else None
 
-        # 1) JSON-LD Product
-        scripts = await page.query_selector_all('script[type="application/ld+json"]')
-        for script in scripts:
-            text = await script.inner_text()
+        # заглядываем в DOM сразу после goto: SSR-страницы уже содержат
+        # JSON-LD с ценой, и ждать селектор в этом случае — потеря ~секунды
+        probe = await page.evaluate(_PAGE_PROBE_JS)
+        texts = probe["lds"]
+        if not any('"price"' in text for text in texts):
+            # цена серверно не пришла — ждём не "тишины" на странице,
+            # а конкретно её появления
             try:
-                data = json.loads(text)
+                # один комбинированный селектор: Playwright сам поллит DOM,
+                # гонять несколько wait-ов по очереди незачем.
+                # attached, а не дефолтный visible: <script> никогда не
+                # «виден», и ветка JSON-LD иначе не срабатывает вовсе
+                await page.wait_for_selector(
+                    'script[type="application/ld+json"], '
+                    '.product-price__big, [class*="product-price"]',
+                    state="attached",
+                    timeout=4000,
+                )
+            except Exception:
+                pass  # цены может не быть — парсер ниже сам разберётся
+            probe = await page.evaluate(_PAGE_PROBE_JS)
+            texts = probe["lds"]
+
+        # 1) JSON-LD Product — один evaluate вместо round-trip'а на каждый <script>
+        for text in texts:
+            # дешёвый префильтр: хлебные крошки и прочие не-Product
+            # JSON-LD блоки не стоят полноценного парсинга
+            if '"Product"' not in text:
+                continue
+            try:
+                data = orjson.loads(text)
 
                 # Rozetka может отдавать список объектов
                 if isinstance(data, list):
                     for item in data:
                         price = extract_price_from_ld(item)
                         if price:
-                            cache[url] = {"price": price, "time": time.time()}
-                            return price
+                            cache[url] = price
+                            return price, status
                 else:
                     price = extract_price_from_ld(data)
                     if price:
-                        cache[url] = {"price": price, "time": time.time()}
-                        return price
+                        cache[url] = price
+                        return price, status
             except Exception:
                 # иногда JSON битый — просто пропускаем
                 continue
 
-        # 2) Fallback HTML — по селекторам цены
-        price_locator = page.locator(
-            '.product-price__big, [itemprop="price"], .product-prices__big'
-        )
-        if await price_locator.count() > 0:
-            price_elem = await price_locator.first.inner_text()
-            price = (
-                price_elem.strip()
-                .replace("₴", "")
-                .replace(" ", "")
-                .replace("\xa0", "")
-            )
-            if price:
-                cache[url] = {"price": price, "time": time.time()}
-                return price
+        # 2) Fallback — текст ценового элемента уже пришёл тем же evaluate
+        price = clean_price(probe["priceText"])
+        if price:
+            cache[url] = price
+            return price, status
 
-        return None
+        return None, status
 
     except Exception as e:
-        print(f"Error scraping {url}: {e}")
-        return None
+        # уровень debug: под нагрузкой это самая частая строка лога
+        logger.debug("Error scraping %s: %s", url, e)
+        return None, None
 
 
-def extract_price_from_ld(item) -> str | None:
-    """Достать цену из JSON-LD объекта Product."""
-    if not isinstance(item, dict):
-        return None
-    if item.get("@type") != "Product":
-        return None
-    offers = item.get("offers")
-    if not offers:
-        return None
-    price = offers.get("price") or offers.get("lowPrice") or offers.get("highPrice")
-    if not price:
-        return None
-    return str(price).replace(" ", "")
+async def scrape_price_via_http(url: str) -> tuple[str | None, bool]:
+    """Быстрый путь: обычный HTTP GET вместо рендера страницы.
+
+    Rozetka обычно отдаёт JSON-LD уже в серверном HTML, так что браузер
+    нужен только когда нас встречает антибот (403/429) или цены в ответе нет.
 
+    Возвращает (цена, окончательно): второй флаг — признак, что ответ
+    разобран и браузер ничего не добавит (например, товар закончился).
+    """
+    cached = cache.get(url)
+    if cached:
+        return cached, True
 
-async def scrape_batch(urls: list[str]) -> dict[str, str]:
-    """Параллельно скрапит батч URL-ов с ограничением по конкарренси."""
+    client = getattr(app.state, "http_client", None)
+    if client is None:
+        return None, False
+
+    # условный GET: если цена протухла, но валидаторы остались,
+    # сервер может ответить 304 — без тела и без повторного парсинга
+    headers = {}
+    validators = _validators.get(url)
+    if validators:
+        etag, last_modified, _ = validators
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+    await smart_delay(url)
+    try:
+        resp = await client.get(url, headers=headers)
+    except Exception as e:
+        logger.debug("HTTP fetch failed for %s: %s", url, e)
+        return None, False
+
+    if resp.status_code == 304 and validators:
+        price = validators[2]
+        cache[url] = price  # страница не менялась — просто продлеваем TTL
+        return price, True
+
+    if resp.status_code != 200:
+        return None, False
+
+    # работаем с байтами ответа: декод всей страницы в str нужен
+    # только в редкой ветке «цены нет» — для регистронезависимых
+    # кириллических маркеров наличия
+    html = resp.content
+    price = parse_price_from_html(html)
+    if price:
+        cache[url] = price
+        etag = resp.headers.get("etag")
+        last_modified = resp.headers.get("last-modified")
+        if etag or last_modified:
+            _validators[url] = (etag, last_modified, price)
+        return price, True
+
+    # цены нет, но страница отдалась: если товар закончился, рендер
+    # в браузере её не вернёт — не жжём вкладку впустую
+    return None, UNAVAIL_RE.search(resp.text) is not None
+
+
+async def scrape_batch(urls: list[str], on_result=None) -> dict[str, str]:
+    """Параллельно скрапит батч URL-ов с ограничением по конкарренси.
+
+    on_result(url, price) зовётся по мере готовности каждого URL —
+    для стримингового ответа, где клиент не ждёт конца всего батча.
+    """
     results: dict[str, str] = {}
-    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
 
-    async with Stealth().use_async(async_playwright()) as p:
-        browser = await p.chromium.launch(headless=True)
-        context = await browser.new_context()
+    # классический worker-pool: очередь URL-ов + по воркеру на слот пула.
+    # Семафор здесь не нужен — параллелизм равен числу тёплых вкладок
+    queue: asyncio.Queue = asyncio.Queue()
+    # группируем по хосту: подряд идущие URL-ы одного хоста достаются
+    # одному воркеру, и его контекст переиспользует тёплые DNS/TLS/HTTP2
+    slots = app.state.slots
+    for u in sorted(urls, key=lambda u: urlparse(u).netloc):
+        queue.put_nowait(u)
+    for _ in slots:
+        queue.put_nowait(None)  # сентинел — по одному на воркера
 
-        await context.add_init_script(
-            "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
-        )
-        await context.set_extra_http_headers(
-            {
-                "User-Agent": (
-                    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
-                    "AppleWebKit/537.36 (KHTML, like Gecko) "
-                    "Chrome/91.0.4472.124 Safari/537.36"
-                )
-            }
-        )
+    async def scrape_one(u: str, page) -> str | None:
+        # сначала пробуем без браузера — это на порядки дешевле
+        price, final = await scrape_price_via_http(u)
+        if price or final:
+            return price
 
-        async def worker(u: str):
-            async with semaphore:
-                page = await context.new_page()
-                try:
-                    for attempt in range(3):
-                        price = await scrape_price_single(page, u)
-                        if price:
-                            results[u] = price
-                            break
-                        await asyncio.sleep(5 + random.uniform(0, 3))
-                finally:
-                    await page.close()
+        for attempt in range(3):
+            price, status = await scrape_price_single(page, u)
+            if price:
+                return price
+            # ретраим только временные сбои; 404 или страница без цены
+            # не изменятся от повторных заходов
+            transient = status is None or status == 429 or status >= 500
+            if not transient:
+                break
+            await asyncio.sleep(min(8, 0.5 * 2**attempt) + random.uniform(0, 0.5))
+        return None
+
+    async def worker(slot):
+        _context, page, lock = slot
+        while True:
+            u = await queue.get()
+            if u is None:
+                break
+
+            # дедупликация: один и тот же URL скрапим только один раз
+            pending = _inflight.get(u)
+            if pending is not None:
+                price = await pending
+                if price:
+                    results[u] = price
+                if on_result:
+                    on_result(u, price)
+                continue
 
-        tasks = [asyncio.create_task(worker(u)) for u in urls]
-        await asyncio.gather(*tasks)
+            fut = asyncio.get_running_loop().create_future()
+            _inflight[u] = fut
+            try:
+                async with lock:  # во вкладке живёт один URL за раз
+                    price = await scrape_one(u, page)
+            except BaseException:
+                fut.set_result(None)
+                raise
+            finally:
+                del _inflight[u]
+            fut.set_result(price)
+            if price:
+                results[u] = price
+            if on_result:
+                on_result(u, price)
 
-        await browser.close()
+    # общий дедлайн на батч: один зависший URL не должен держать
+    # остальные результаты заложниками — по истечении воркеры
+    # отменяются, а наружу уходит то, что успели собрать
+    deadline = 2 * len(urls) + 10
+    try:
+        async with asyncio.timeout(deadline):
+            # return_exceptions: упавший воркер не должен ронять весь батч
+            outcomes = await asyncio.gather(
+                *(worker(slot) for slot in slots), return_exceptions=True
+            )
+    except TimeoutError:
+        logger.warning(
+            "Batch deadline of %ds hit, returning %d/%d results",
+            deadline,
+            len(results),
+            len(urls),
+        )
+        return results
+    for outcome in outcomes:
+        if isinstance(outcome, Exception):
+            logger.error("Batch worker failed: %s", outcome)
 
     return results
 
 
 @app.post("/update")
 async def update(request: Request):
-    body = await request.json()
+    # тело разбираем orjson-ом сами: на батче в тысячи URL это заметно
+    # быстрее стандартного request.json()
+    try:
+        body = orjson.loads(await request.body())
+    except orjson.JSONDecodeError:
+        return ORJSONResponse({"error": "invalid json"}, status_code=400)
+    if not isinstance(body, dict):
+        return ORJSONResponse({"error": "invalid json"}, status_code=400)
+
     raw_urls = body.get("urls", [])
+    if not isinstance(raw_urls, list):
+        return ORJSONResponse({"error": "urls must be a list"}, status_code=400)
+    if len(raw_urls) > MAX_BATCH:
+        return ORJSONResponse({"error": "batch too large"}, status_code=413)
 
-    # фильтруем мусор (типа "ссылка" и пустые строки)
-    urls = [u for u in raw_urls if is_valid_http_url(u)]
+    # фильтруем мусор (типа "ссылка" и пустые строки) и нормализуем
+    # isinstance снаружи: lru_cache не переживёт нехэшируемый аргумент
+    # dict.fromkeys: дубли выкидываем ещё до очереди (после нормализации
+    # ими становятся и url с разными #fragment), порядок сохраняется
+    urls = list(
+        dict.fromkeys(
+            n
+            for u in raw_urls
+            if isinstance(u, str) and (n := _normalize_url(u)) is not None
+        )
+    )
     if not urls:
-        print("No valid URLs received:", raw_urls)
+        logger.warning("No valid URLs received: %s", raw_urls)
         return {"data": {}}
 
-    print("Scraping URLs:", urls)
+    # сам список URL-ов — только в debug: на батче в тысячи ссылок
+    # форматирование строки дороже, чем весь остальной обработчик
+    logger.info("Scraping batch of %d URLs", len(urls))
+    logger.debug("URLs: %s", urls)
+
+    # с вебхуком работаем в фоне: отвечаем сразу, результат прилетит POST-ом
+    webhook = body.get("webhook")
+    if webhook is not None and not (
+        isinstance(webhook, str) and is_valid_http_url(webhook)
+    ):
+        return ORJSONResponse({"error": "invalid webhook url"}, status_code=400)
+
+    if webhook:
+        try:
+            app.state.jobs.put_nowait((urls, None, webhook))
+        except asyncio.QueueFull:
+            return ORJSONResponse({"error": "queue full"}, status_code=503)
+        return {"status": "accepted"}
+
+    # ?stream=1 — отдаём NDJSON по мере готовности каждого URL, клиент
+    # начинает обрабатывать первые цены, пока мы ещё скрапим остальные
+    if request.query_params.get("stream") == "1":
+        out: asyncio.Queue = asyncio.Queue()
+
+        async def run():
+            try:
+                await scrape_batch(
+                    urls, on_result=lambda u, p: out.put_nowait((u, p))
+                )
+            finally:
+                out.put_nowait(None)  # сентинел — батч закончился
+
+        task = asyncio.create_task(run())
+
+        async def gen():
+            while True:
+                item = await out.get()
+                if item is None:
+                    break
+                u, price = item
+                yield orjson.dumps({"url": u, "price": price}) + b"\n"
+            await task
+
+        return StreamingResponse(gen(), media_type="application/x-ndjson")
+
+    fut = asyncio.get_running_loop().create_future()
+    try:
+        app.state.jobs.put_nowait((urls, fut, None))
+    except asyncio.QueueFull:
+        # лучше честный 503, чем лавина задач поверх занятого браузера
+        return ORJSONResponse({"error": "queue full"}, status_code=503)
 
-    prices = await scrape_batch(urls)
+    prices = await fut
     # формат ответа: { "data": { url: price, ... } }
     return {"data": prices}
 
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=9001)
+    # uvloop + httptools: C-реализации event loop и HTTP-парсера
+    uvicorn.run(app, host="0.0.0.0", port=9001, loop="uvloop", http="httptools")